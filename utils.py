@@ -17,6 +17,8 @@ try:
         anchorlinenos=True,
         lineanchors="line",
     )
+    _diff_formatter = HtmlFormatter(encoding="utf-8", cssclass="source_code")
+    _diff_lexer = lexers.DiffLexer(encoding="utf-8")
 except ImportError:
     pygments = None
 
@@ -29,6 +31,7 @@ except ImportError:
 import base64
 import difflib
 import functools
+import hashlib
 import html
 import mimetypes
 import re
@@ -42,13 +45,83 @@ import os.path
 import git
 
 
+# Where rendered blobs are stored across runs, see _disk_cache(). Setting
+# $GIT_ARR_CACHE to an empty string disables the on-disk cache.
+_cache_dir = os.environ.get(
+    "GIT_ARR_CACHE", os.path.expanduser("~/.cache/git-arr")
+)
+
+# Version of our own rendering output. Bump it whenever a change alters the
+# HTML produced by the disk-cached functions (formatter options, lexer
+# selection, markdown extensions, ...), so old cache entries are not reused.
+_CACHE_VERSION = 1
+
+# Included in the cache keys, so upgrading git-arr or the libraries that do
+# the rendering doesn't leave us serving stale output.
+_cache_salt = " ".join(
+    [
+        str(_CACHE_VERSION),
+        pygments.__version__ if pygments else "-",
+        markdown.__version__ if markdown else "-",
+    ]
+)
+
+
+def _disk_cache(f):
+    """Decorator to cache the output of an HTML rendering function on disk.
+
+    The key is a hash of all the (string) arguments, so the cached output is
+    reused across runs as long as the content does not change. Errors while
+    reading or writing the cache are not fatal, we just render again.
+    """
+
+    @functools.wraps(f)
+    def wrapper(*args):
+        if not _cache_dir:
+            return f(*args)
+
+        h = hashlib.blake2b(_cache_salt.encode("utf-8"), digest_size=16)
+        for arg in args:
+            h.update(b"\0")
+            h.update(arg.encode("utf-8", "surrogatepass"))
+        key = h.hexdigest()
+        path = os.path.join(_cache_dir, f.__name__, key[:2], key + ".html")
+
+        # A bad entry (e.g. not valid UTF-8) is treated as a miss, and gets
+        # overwritten below.
+        try:
+            with open(path, "rb") as fd:
+                return fd.read().decode("utf-8")
+        except (OSError, UnicodeDecodeError):
+            pass
+
+        out = f(*args)
+        if isinstance(out, bytes):
+            out = out.decode("utf-8")
+
+        # Write to a temporary file and then rename it into place, so an
+        # interrupted run can't leave a truncated entry behind.
+        tmp_path = "%s.%d.tmp" % (path, os.getpid())
+        try:
+            data = out.encode("utf-8")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, "wb") as fd:
+                fd.write(data)
+            os.replace(tmp_path, path)
+        except (OSError, UnicodeEncodeError):
+            pass
+
+        return out
+
+    return wrapper
+
+
 def shorten(s: str, width=60):
-    if len(s) < 60:
+    if len(s) < width:
         return s
-    return s[:57] + "..."
+    return s[: width - 3] + "..."
 
 
-@functools.lru_cache
 def can_colorize(s: str):
     """True if we can colorize the string, False otherwise."""
     if pygments is None:
@@ -60,17 +133,10 @@ def can_colorize(s: str):
         return False
 
     # If any of the first 5 lines is over 300 characters long, don't colorize.
-    start = 0
-    for i in range(5):
-        pos = s.find("\n", start)
-        if pos == -1:
-            break
-
-        if pos - start > 300:
-            return False
-        start = pos + 1
-
-    return True
+    # Those fit within the first 2000 characters if they're short enough, so
+    # we only need to look at that.
+    lines = s[:2000].split("\n", 5)[:5]
+    return all(len(line) <= 300 for line in lines)
 
 
 def can_markdown(repo: git.Repo, fname: str):
@@ -94,164 +160,268 @@ def can_embed_image(repo, fname):
     )
 
 
-@functools.lru_cache
+@functools.lru_cache(maxsize=512)
 def colorize_diff(s: str) -> str:
-    lexer = lexers.DiffLexer(encoding="utf-8")
-    formatter = HtmlFormatter(encoding="utf-8", cssclass="source_code")
-
-    return highlight(s, lexer, formatter)
+    return highlight(s, _diff_lexer, _diff_formatter)
 
 
-def _compute_line_diff(old_line: str, new_line: str):
+def _emit_line_diff(old_line: str, new_line: str, old_out, new_out):
     """
-    Compute character-level diff between two lines.
-    Returns (old_parts, new_parts) where each is a list of (text, is_changed).
+    Compute character-level diff between two lines, and render them with the
+    changed parts highlighted: the HTML for the old line is appended to
+    old_out, and the one for the new line to new_out.
     """
-    matcher = difflib.SequenceMatcher(None, old_line, new_line)
-    old_parts = []
-    new_parts = []
-
+    # Modified lines usually differ only in a small region, so strip the
+    # common prefix and suffix and let SequenceMatcher (which is slow, and
+    # quadratic in the worst case) look only at what's left.
+    prefix = os.path.commonprefix([old_line, new_line])
+    if prefix:
+        escaped = html.escape(prefix)
+        old_out.append(escaped)
+        new_out.append(escaped)
+
+    old_mid = old_line[len(prefix):]
+    new_mid = new_line[len(prefix):]
+    suffix = os.path.commonprefix([old_mid[::-1], new_mid[::-1]])[::-1]
+    if suffix:
+        old_mid = old_mid[: -len(suffix)]
+        new_mid = new_mid[: -len(suffix)]
+
+    matcher = difflib.SequenceMatcher(None, old_mid, new_mid)
     for tag, i1, i2, j1, j2 in matcher.get_opcodes():
         if tag == 'equal':
-            old_parts.append((old_line[i1:i2], False))
-            new_parts.append((new_line[j1:j2], False))
-        elif tag == 'replace':
-            old_parts.append((old_line[i1:i2], True))
-            new_parts.append((new_line[j1:j2], True))
-        elif tag == 'delete':
-            old_parts.append((old_line[i1:i2], True))
-        elif tag == 'insert':
-            new_parts.append((new_line[j1:j2], True))
+            old_out.append(html.escape(old_mid[i1:i2]))
+            new_out.append(html.escape(new_mid[j1:j2]))
+            continue
+        if i1 < i2:
+            old_out.extend(
+                (_removed_hl_open, html.escape(old_mid[i1:i2]), _span_close)
+            )
+        if j1 < j2:
+            new_out.extend(
+                (_added_hl_open, html.escape(new_mid[j1:j2]), _span_close)
+            )
 
-    return old_parts, new_parts
+    if suffix:
+        escaped = html.escape(suffix)
+        old_out.append(escaped)
+        new_out.append(escaped)
 
 
-def _render_line_parts(parts, line_type):
-    """
-    Render line parts with appropriate highlighting.
-    line_type: 'removed' or 'added'
-    """
-    result = []
-    for text, is_changed in parts:
-        if not text:
-            continue
-        escaped = html.escape(text)
-        if is_changed:
-            result.append(f'<span class="diff-{line_type}-highlight">{escaped}</span>')
-        else:
-            result.append(escaped)
-    return ''.join(result)
+# Line prefixes of the per-file diff headers.
+_diff_header_prefixes = ("diff --git", "index ", "---", "+++")
+
+# Fragments of the HTML for the diff lines, which are emitted as separate
+# strings rather than formatted together, to save an allocation per line.
+_removed_line_open = '<div class="diff-line diff-line-removed">'
+_added_line_open = '<div class="diff-line diff-line-added">'
+_context_line_open = '<div class="diff-line diff-line-context">'
+_div_close = '</div>'
+_removed_hl_open = '<span class="diff-removed-highlight">'
+_added_hl_open = '<span class="diff-added-highlight">'
+_span_close = '</span>'
+
+# Hunk header line, separating the "@@ ... @@" part from the trailing context.
+_hunk_header_re = re.compile(r"^(@@[^@]*@@)(.*)")
 
 
-@functools.lru_cache
+@functools.lru_cache(maxsize=512)
 def colorize_diff_enhanced(s: str) -> str:
     """
     Enhanced diff rendering with character-level change highlighting.
     Similar to delta's output style.
     """
+    # Render hunk by hunk: hunks are independent of each other, and the same
+    # ones show up over and over (e.g. in a commit and in its patch, or when a
+    # change is cherry-picked), so caching them individually gets us many
+    # more hits than caching whole diffs.
+    output = ['<div class="enhanced-diff">']
+    for segment in _iter_hunks(s):
+        output.append(_render_hunk(segment))
+    output.append('</div>')
+    return ''.join(output)
+
+
+# End of a line that is followed by a hunk header or a new file's headers,
+# see _iter_hunks().
+_segment_end_re = re.compile(r"\n(?=@@|diff --git)")
+
+
+def _iter_hunks(s: str):
+    """
+    Split a diff right before each hunk header ("@@" at the beginning of a
+    line) and each file header ("diff --git"), so every hunk and every
+    file's header lines are a segment of their own. The segments are yielded
+    one by one so we don't keep a second copy of the whole diff around.
+    """
+    start = 0
+    while True:
+        match = _segment_end_re.search(s, start)
+        if match is None:
+            yield s[start:]
+            return
+        yield s[start : match.end()]
+        start = match.end()
+
+
+@functools.lru_cache(maxsize=4096)
+def _render_hunk(s: str) -> str:
+    """
+    Render a segment of a diff: either a hunk (starting with its "@@" line),
+    or the file headers that precede the first one.
+    """
     lines = s.split('\n')
     output = []
-    output.append('<div class="enhanced-diff">')
 
+    # Each handler renders the line at lines[i] (and possibly some of the
+    # following ones), and returns the index of the next line to render.
     i = 0
     while i < len(lines):
-        line = lines[i]
+        handler = _diff_line_handlers.get(lines[i][:1], _handle_other_line)
+        i = handler(lines, i, output)
 
-        # Diff header lines (diff --git, index, +++, ---)
-        if line.startswith('diff --git') or line.startswith('index ') or \
-           line.startswith('---') or line.startswith('+++'):
-            output.append(f'<div class="diff-header">{html.escape(line)}</div>')
-            i += 1
-            continue
+    return ''.join(output)
 
-        # Hunk headers (@@ ... @@)
-        if line.startswith('@@'):
-            # Extract hunk header and any trailing context
-            match = re.match(r'^(@@[^@]*@@)(.*)', line)
-            if match:
-                hunk_info, context = match.groups()
-                output.append(f'<div class="diff-hunk-header">')
-                output.append(f'<span class="diff-hunk-info">{html.escape(hunk_info)}</span>')
-                if context:
-                    output.append(f'<span class="diff-hunk-context">{html.escape(context)}</span>')
-                output.append('</div>')
-            else:
-                output.append(f'<div class="diff-hunk-header">{html.escape(line)}</div>')
-            i += 1
-            continue
 
-        # Check for modified line pairs (- followed by +)
-        if line.startswith('-') and not line.startswith('---') and \
-           i + 1 < len(lines) and lines[i + 1].startswith('+') and \
-           not lines[i + 1].startswith('+++'):
+@functools.lru_cache(maxsize=8192)
+def _escape(s: str) -> str:
+    """Memoized html.escape(), for context lines: the same ones show up
+    again and again in diffs touching the same file."""
+    return html.escape(s)
 
-            old_line = line[1:]  # Remove leading '-'
-            new_line = lines[i + 1][1:]  # Remove leading '+'
 
-            # Compute character-level diff
-            old_parts, new_parts = _compute_line_diff(old_line, new_line)
+def _handle_header_line(lines, i, output):
+    """Diff header lines (diff --git, index, +++, ---)."""
+    line = lines[i]
+    if not line.startswith(_diff_header_prefixes):
+        return _handle_other_line(lines, i, output)
 
-            # Render both lines with inline highlighting
-            output.append('<div class="diff-line diff-line-removed">')
-            output.append(_render_line_parts(old_parts, 'removed'))
-            output.append('</div>')
+    output.append(f'<div class="diff-header">{html.escape(line)}</div>')
+    return i + 1
 
-            output.append('<div class="diff-line diff-line-added">')
-            output.append(_render_line_parts(new_parts, 'added'))
-            output.append('</div>')
 
-            i += 2
-            continue
+def _handle_removed_line(lines, i, output):
+    """Removed lines; if followed by an added line, they're a modified pair
+    and we highlight the changes within them."""
+    line = lines[i]
+    if line.startswith('---'):
+        return _handle_header_line(lines, i, output)
 
-        # Regular removed line
-        if line.startswith('-') and not line.startswith('---'):
-            output.append('<div class="diff-line diff-line-removed">')
-            output.append(html.escape(line[1:]))
-            output.append('</div>')
-            i += 1
-            continue
+    next_line = lines[i + 1] if i + 1 < len(lines) else ''
+    if next_line[:1] != '+' or next_line.startswith('+++'):
+        output.extend((_removed_line_open, html.escape(line[1:]), _div_close))
+        return i + 1
 
-        # Regular added line
-        if line.startswith('+') and not line.startswith('+++'):
-            output.append('<div class="diff-line diff-line-added">')
-            output.append(html.escape(line[1:]))
-            output.append('</div>')
-            i += 1
-            continue
+    old_line = line[1:]  # Remove leading '-'
+    new_line = next_line[1:]  # Remove leading '+'
 
-        # Context line (unchanged)
-        if line.startswith(' '):
-            output.append('<div class="diff-line diff-line-context">')
-            output.append(html.escape(line[1:]))
-            output.append('</div>')
-            i += 1
-            continue
+    # Render both lines with inline highlighting; the old one goes straight
+    # into the output, the new one has to wait until the old one is done.
+    added = [_added_line_open]
+    output.append(_removed_line_open)
+    _emit_line_diff(old_line, new_line, output, added)
+    output.append(_div_close)
+    output.extend(added)
+    output.append(_div_close)
 
-        # Other lines (shouldn't normally happen in well-formed diffs)
-        if line:
-            output.append(f'<div class="diff-line">{html.escape(line)}</div>')
-        i += 1
+    return i + 2
 
-    output.append('</div>')
-    return ''.join(output)
+
+def _handle_added_line(lines, i, output):
+    """Regular added line."""
+    line = lines[i]
+    if line.startswith('+++'):
+        return _handle_header_line(lines, i, output)
+
+    output.extend((_added_line_open, html.escape(line[1:]), _div_close))
+    return i + 1
+
+
+def _handle_context_line(lines, i, output):
+    """Context line (unchanged)."""
+    output.extend((_context_line_open, _escape(lines[i][1:]), _div_close))
+    return i + 1
+
+
+def _handle_hunk_header_line(lines, i, output):
+    """Hunk headers (@@ ... @@)."""
+    line = lines[i]
+    if not line.startswith('@@'):
+        return _handle_other_line(lines, i, output)
+
+    # Extract hunk header and any trailing context
+    match = _hunk_header_re.match(line)
+    if match:
+        hunk_info, context = match.groups()
+        output.append(f'<div class="diff-hunk-header">')
+        output.append(f'<span class="diff-hunk-info">{html.escape(hunk_info)}</span>')
+        if context:
+            output.append(f'<span class="diff-hunk-context">{html.escape(context)}</span>')
+        output.append('</div>')
+    else:
+        output.append(f'<div class="diff-hunk-header">{html.escape(line)}</div>')
+    return i + 1
+
+
+def _handle_other_line(lines, i, output):
+    """Other lines (shouldn't normally happen in well-formed diffs)."""
+    line = lines[i]
+    if line:
+        output.append(f'<div class="diff-line">{html.escape(line)}</div>')
+    return i + 1
+
+
+# Diff line handlers for _render_hunk(), by the first character of the line.
+_diff_line_handlers = {
+    'd': _handle_header_line,
+    'i': _handle_header_line,
+    '-': _handle_removed_line,
+    '+': _handle_added_line,
+    ' ': _handle_context_line,
+    '@': _handle_hunk_header_line,
+}
 
 
-@functools.lru_cache
 def colorize_blob(fname, s: str) -> str:
+    # Empty files don't need Pygments, and the ones can_colorize() rejects
+    # would take too long with it; render them as plain text, the same way
+    # the blob template does, and without filling the caches with them.
+    if not s or not can_colorize(s):
+        return '<pre class="blob-body">' + html.escape(s) + "</pre>"
+
+    # Pick the lexer by the file's basename rather than its content, so the
+    # lookup can be cached; this still matches whole-name patterns like
+    # "Makefile.am" or ".bashrc". The output depends only on that and the
+    # content, so identical files in different directories share the cache.
+    return _colorize_blob(os.path.basename(fname), s)
+
+
+@functools.lru_cache(maxsize=512)
+@_disk_cache
+def _colorize_blob(name: str, s: str) -> str:
+    shebang = s[:80] if s.startswith("#!") else ""
+
+    return highlight(s, _lexer_for(name, shebang), _html_formatter)
+
+
+@functools.lru_cache(maxsize=256)
+def _lexer_for(name: str, shebang: str):
+    """Find the lexer for the given file name and shebang."""
     try:
-        lexer = lexers.guess_lexer_for_filename(fname, s, encoding="utf-8")
+        return lexers.get_lexer_for_filename(name, encoding="utf-8")
     except lexers.ClassNotFound:
-        # Only try to guess lexers if the file starts with a shebang,
-        # otherwise it's likely a text file and guess_lexer() is prone to
-        # make mistakes with those.
-        lexer = lexers.TextLexer(encoding="utf-8")
-        if s.startswith("#!"):
-            try:
-                lexer = lexers.guess_lexer(s[:80], encoding="utf-8")
-            except lexers.ClassNotFound:
-                pass
+        pass
+
+    # Only try to guess lexers if the file starts with a shebang, otherwise
+    # it's likely a text file and guess_lexer() is prone to make mistakes
+    # with those.
+    if shebang:
+        try:
+            return lexers.guess_lexer(shebang, encoding="utf-8")
+        except lexers.ClassNotFound:
+            pass
 
-    return highlight(s, lexer, _html_formatter)
+    return lexers.TextLexer(encoding="utf-8")
 
 
 def embed_image_blob(fname: str, image_data: bytes) -> str:
@@ -262,24 +432,37 @@ def embed_image_blob(fname: str, image_data: bytes) -> str:
     )
 
 
-@functools.lru_cache
 def is_binary(b: bytes):
     # Git considers a blob binary if NUL in first ~8KB, so do the same.
+    # This is not cached on purpose: a cache would have to hash the whole
+    # blob, which costs more than looking for the NUL.
     return b"\0" in b[:8192]
 
 
-@functools.lru_cache
+# Translation table for the text column of hexdump(): printable characters
+# are kept, and everything else is replaced with a dot.
+_hexdump_graph = (
+    string.ascii_letters + string.digits + string.punctuation + " "
+).encode("ascii")
+_hexdump_table = bytes(
+    c if c in _hexdump_graph else ord(".") for c in range(256)
+)
+
+
+@functools.lru_cache(maxsize=128)
 def hexdump(s: bytes):
-    graph = string.ascii_letters + string.digits + string.punctuation + " "
-    b = s.decode("latin1")
-    offset = 0
-    while b:
-        t = b[:16]
-        hexvals = ["%.2x" % ord(c) for c in t]
-        text = "".join(c if c in graph else "." for c in t)
-        yield offset, " ".join(hexvals[:8]), " ".join(hexvals[8:]), text
-        offset += 16
-        b = b[16:]
+    """Return the hex dump of s, as a list of (offset, hex of the first 8
+    bytes, hex of the last 8 bytes, text) rows of 16 bytes each.
+
+    The input is hashed as the cache key, so callers should pass only the
+    part they want to show (e.g. bytes(b[:limit])) rather than a huge blob.
+    """
+    rows = []
+    for offset in range(0, len(s), 16):
+        t = s[offset : offset + 16]
+        text = t.translate(_hexdump_table).decode("ascii")
+        rows.append((offset, t[:8].hex(" "), t[8:].hex(" "), text))
+    return rows
 
 
 if markdown:
@@ -295,24 +478,18 @@ if markdown:
         """
 
         def run(self, root):
-            for child in root:
-                if child.tag == "a":
-                    self.rewrite_href(child)
-
-                # Continue recursively.
-                self.run(child)
-
-        def rewrite_href(self, tag):
-            """Rewrite an <a>'s href."""
-            target = tag.get("href")
-            if not target:
-                return
-            if "://" in target or target.startswith("/"):
-                return
-
-            head, tail = os.path.split(target)
-            new_target = os.path.join(head, "f=" + tail + ".html")
-            tag.set("href", new_target)
+            # iter() walks the whole tree for us, without recursing in
+            # Python.
+            for tag in root.iter("a"):
+                attrib = tag.attrib
+                target = attrib.get("href")
+                if not target:
+                    continue
+                if "://" in target or target.startswith("/"):
+                    continue
+
+                head, tail = os.path.split(target)
+                attrib["href"] = os.path.join(head, "f=" + tail + ".html")
 
     class RewriteLocalLinksExtension(markdown.Extension):
         def extendMarkdown(self, md):
@@ -326,9 +503,14 @@ if markdown:
         RewriteLocalLinksExtension(),
     ]
 
-    @functools.lru_cache
+    # Setting up the extensions is a good part of the cost of converting a
+    # small document, so we use a single instance, resetting it in between.
+    _md = markdown.Markdown(extensions=_md_extensions)
+
+    @functools.lru_cache(maxsize=512)
+    @_disk_cache
     def markdown_blob(s: str) -> str:
-        return markdown.markdown(s, extensions=_md_extensions)
+        return _md.reset().convert(s)
 
 else:
 
@@ -345,17 +527,16 @@ def log_timing(*log_args):
     def log_timing_decorator(f):
         argspec = inspect.getfullargspec(f)
         idxs = [argspec.args.index(arg) for arg in log_args]
+        name = f.__name__
 
         @functools.wraps(f)
         def wrapper(*args, **kwargs):
-            start = time.time()
+            start = time.perf_counter()
             result = f(*args, **kwargs)
-            end = time.time()
+            end = time.perf_counter()
 
-            f_args = [args[i] for i in idxs]
-            sys.stderr.write(
-                "%.4fs  %s %s\n" % (end - start, f.__name__, " ".join(f_args))
-            )
+            f_args = " ".join(args[i] for i in idxs)
+            sys.stderr.write(f"{end - start:.4f}s  {name} {f_args}\n")
             return result
 
         return wrapper